@@ -11,6 +11,10 @@ in preparation for template generation. More specifically:
     positions of intervertebral discs,
 * Straightening of all subjects' spinal cord on the initial template space.
 
+If several contrasts are listed in the configuration file, the steps above are computed once, on the reference
+contrast, and the other contrasts are straightened with the same warping fields. Intensity normalization and
+conversion to MINC format are then done for each contrast.
+
 The data are expected to be located according to the following file structure:
 
 ├── sub-XXX  <---- image
@@ -31,9 +35,15 @@ Usage: `python preprocess_normalize.py configuration.json`
 
 import json
 import os
+import gzip
+import hashlib
 import shutil
+import threading
 import numpy as np
+import nibabel as nib
 import csv
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from copy import copy
 from tqdm import tqdm
 import sys
@@ -114,6 +124,107 @@ def read_dataset(fname_json = 'configuration.json', path_data = './'):
 
     return dataset_info
 
+def split_contrasts(dataset_info):
+    """
+    This function splits the dataset information into one dictionary per contrast. Several contrasts can be listed in
+    the fields `suffix_image` and `contrast`, separated with spaces (e.g. "_T1w _T2w" and "t1 t2"). The first contrast
+    is the reference contrast, on which the template space, centerline and disc geometry are computed.
+    :param dataset_info: dictionary containing dataset information
+    :return: list of dictionaries containing dataset information, with a single `suffix_image` and `contrast` each,
+             starting with the reference contrast
+    """
+    list_suffix_image = dataset_info['suffix_image'].split()
+    list_contrast = dataset_info['contrast'].split()
+    if len(list_contrast) == 1: list_contrast = list_contrast * len(list_suffix_image)
+    if len(list_suffix_image) == 0 or len(list_contrast) != len(list_suffix_image):
+        raise ValueError('Fields \'contrast\' and \'suffix_image\' must list at least one contrast, and the same number of contrasts.')
+
+    list_dataset_info = []
+    for suffix_image, contrast in zip(list_suffix_image, list_contrast):
+        dataset_info_contrast = dataset_info.copy()
+        dataset_info_contrast['suffix_image'] = suffix_image
+        dataset_info_contrast['contrast'] = contrast
+        list_dataset_info.append(dataset_info_contrast)
+    return list_dataset_info
+
+def get_size_nifti(list_fname):
+    """
+    This function estimates the memory that NIFTI files will occupy once decoded, from their headers only
+    :param list_fname: list of path + file name of NIFTI files
+    :return: size in bytes
+    """
+    size = 0
+    for fname in list_fname:
+        header = nib.load(fname).header
+        slope, inter = header.get_slope_inter()
+        # scaled data are decoded as floating point values
+        dtype = np.dtype('float64') if slope not in [None, 1] or inter not in [None, 0] else header.get_data_dtype()
+        size += int(np.prod(header.get_data_shape())) * dtype.itemsize
+    return size
+
+def prefetch(list_items, load, get_size, n_ahead = 2, max_bytes = 2 * 1024 ** 3):
+    """
+    This function loads the next items of a list on background threads while the current item is processed, so that
+    file reading and gzip decoding overlap with computation
+    :param list_items: list of items to load (e.g. subject names)
+    :param load: function loading one item
+    :param get_size: function estimating, before loading, the memory that the output of load(item) will occupy
+        (e.g. with get_size_nifti()); it runs on the calling thread, so it should only read file headers
+    :param n_ahead: maximum number of items loaded ahead of the one being processed (at least 1)
+    :param max_bytes: an item is not loaded ahead if the items being loaded or waiting to be processed would then
+        occupy more than this; the next item is always loaded, whatever its size
+    :return: generator of (item, output of load(item)), in the order of list_items
+    """
+    iterator = iter(list_items)
+    end = object()
+    queue = deque()
+    pending = None  # (item, size) taken from the iterator but not submitted yet, because of max_bytes
+    with ThreadPoolExecutor(max_workers = n_ahead) as executor:
+        def fill_queue():
+            nonlocal pending
+            while len(queue) < n_ahead:
+                if pending is None:
+                    item = next(iterator, end)
+                    if item is end: return
+                    pending = (item, get_size(item))
+                item, size = pending
+                queued_bytes = sum(size_queued for _, size_queued, _ in queue)
+                if queue and queued_bytes + size > max_bytes: return
+                pending = None
+                queue.append((item, size, executor.submit(load, item)))
+
+        fill_queue()
+        while queue:
+            item, _, future = queue.popleft()
+            result = future.result()
+            fill_queue()
+            yield item, result
+
+class BackgroundWriter:
+    """
+    Context manager running file writes on background threads, so that the next item can be processed while the
+    current one is saved. At most `max_pending` writes are queued: submit() blocks when the queue is full, which
+    bounds the memory held by volumes waiting to be written. Errors raised by the writes are raised on exit.
+    """
+    def __init__(self, max_pending = 2, n_workers = 1):
+        self.executor = ThreadPoolExecutor(max_workers = n_workers)
+        self.semaphore = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+
+    def submit(self, function, *args, **kwargs):
+        self.semaphore.acquire()
+        future = self.executor.submit(function, *args, **kwargs)
+        future.add_done_callback(lambda _: self.semaphore.release())
+        self.futures.append(future)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.executor.shutdown(wait = True)
+        if exc_type is None:
+            for future in self.futures: future.result()
+
 def generate_centerline(dataset_info, algo_fitting = 'linear', smooth = 50, degree = None, minmax = None):
     """
     This function generates spinal cord centerline from binary images (either an image of centerline or segmentation)
@@ -128,48 +239,69 @@ def generate_centerline(dataset_info, algo_fitting = 'linear', smooth = 50, degr
 
     tqdm_bar = tqdm(total = len(list_subjects), unit = 'B', unit_scale = True, desc = "Status", ascii = True)
 
-    # obtaining centerline of each subject
-    for subject_name in list_subjects:
+    def get_fnames(subject_name):
         fname_image = path_data + subject_name + '/' + dataset_info['data_type'] + '/' + subject_name + dataset_info['suffix_image'] + '.nii.gz'
         fname_image_seg = path_data + 'derivatives/labels/' + subject_name +  '/' + dataset_info['data_type'] + '/' + subject_name + dataset_info['suffix_image'] + '_label-SC_mask.nii.gz'
         fname_image_discs = path_data + 'derivatives/labels/' + subject_name +  '/' + dataset_info['data_type'] + '/' + subject_name + dataset_info['suffix_image'] + '_labels-disc.nii.gz'
         fname_image_centerline = path_data + 'derivatives/labels/' + subject_name +  '/' + dataset_info['data_type'] + '/' + subject_name + dataset_info['suffix_image'] + '_label-centerline.nii.gz'
-        
+        return fname_image, fname_image_seg, fname_image_discs, fname_image_centerline
+
+    # estimating the memory of the images kept by load_subject() (the centerline if it exists, else the image)
+    def get_size_subject(subject_name):
+        fname_image, fname_image_seg, fname_image_discs, fname_image_centerline = get_fnames(subject_name)
+        fname_input = fname_image_centerline if os.path.isfile(fname_image_centerline) else fname_image
+        return get_size_nifti([fname_input, fname_image_discs])
+
+    # loading images of one subject (run in the background by prefetch()); messages are printed when the subject is processed
+    def load_subject(subject_name):
+        fname_image, fname_image_seg, fname_image_discs, fname_image_centerline = get_fnames(subject_name)
+        native_orientation = None
+        messages = []
+
         if os.path.isfile(fname_image_seg):
-            print(subject_name + ' SC segmentation exists. Extracting centerline from ' + fname_image_seg)
+            messages.append(subject_name + ' SC segmentation exists. Extracting centerline from ' + fname_image_seg)
             im_seg = Image(fname_image_seg).change_orientation('RPI')
             param_centerline = ParamCenterline(algo_fitting = algo_fitting, smooth = smooth, degree = degree, minmax = minmax) 
         if os.path.isfile(fname_image_centerline):
-            print(subject_name + ' centerline exists. Extracting centerline from ' + fname_image_centerline)
+            messages.append(subject_name + ' centerline exists. Extracting centerline from ' + fname_image_centerline)
             im_seg = Image(fname_image_centerline).change_orientation('RPI')
             param_centerline = ParamCenterline(algo_fitting = algo_fitting, smooth = smooth, degree = degree, minmax = minmax) 
         else:
-            print(subject_name + ' SC segmentation does not exist. Extracting centerline from ' + fname_image)
-            native_orientation = Image(fname_image).orientation
-            im_seg = Image(fname_image).change_orientation('RPI')
+            messages.append(subject_name + ' SC segmentation does not exist. Extracting centerline from ' + fname_image)
+            im_seg = Image(fname_image)
+            native_orientation = im_seg.orientation
+            im_seg.change_orientation('RPI')
             param_centerline = ParamCenterline(algo_fitting = 'optic', smooth = smooth, degree = 5, minmax = minmax, contrast = dataset_info['contrast'])
 
-        # extracting intervertebral discs
         im_discs = Image(fname_image_discs).change_orientation('RPI')
-        coord = im_discs.getNonZeroCoordinates(sorting = 'z', reverse_coord = True)
-        coord_physical = []
-        for c in coord:
-            if c.value <= last_disc or c.value in [48, 49, 50, 51, 52]:
-                c_p = list(im_discs.transfo_pix2phys([[c.x, c.y, c.z]])[0])
-                c_p.append(c.value)
-                coord_physical.append(c_p)
-
-        # extracting centerline
-        im_centerline, arr_ctl, arr_ctl_der, _ = get_centerline(im_seg, param = param_centerline, space = 'phys')
-        centerline = Centerline(points_x = arr_ctl[0], points_y = arr_ctl[1], points_z = arr_ctl[2], deriv_x = arr_ctl_der[0], deriv_y = arr_ctl_der[1], deriv_z = arr_ctl_der[2])
-        centerline.compute_vertebral_distribution(coord_physical)
-
-        # save centerline as NIFTI file if subject's SC mask does not exist (needed for straighten_all_subjects() below)
-        if not os.path.isfile(fname_image_seg) and not os.path.isfile(fname_image_centerline):
-            im_centerline.change_orientation(native_orientation).save(fname_image_centerline)
-
-        list_centerline.append(centerline)
-        tqdm_bar.update(1)
+        return messages, native_orientation, param_centerline, im_seg, im_discs
+
+    # obtaining centerline of each subject
+    with BackgroundWriter() as writer:
+        for subject_name, (messages, native_orientation, param_centerline, im_seg, im_discs) in prefetch(list_subjects, load_subject, get_size_subject):
+            _, fname_image_seg, _, fname_image_centerline = get_fnames(subject_name)
+            for message in messages: print(message)
+
+            # extracting intervertebral discs
+            coord = im_discs.getNonZeroCoordinates(sorting = 'z', reverse_coord = True)
+            coord_physical = []
+            for c in coord:
+                if c.value <= last_disc or c.value in [48, 49, 50, 51, 52]:
+                    c_p = list(im_discs.transfo_pix2phys([[c.x, c.y, c.z]])[0])
+                    c_p.append(c.value)
+                    coord_physical.append(c_p)
+
+            # extracting centerline
+            im_centerline, arr_ctl, arr_ctl_der, _ = get_centerline(im_seg, param = param_centerline, space = 'phys')
+            centerline = Centerline(points_x = arr_ctl[0], points_y = arr_ctl[1], points_z = arr_ctl[2], deriv_x = arr_ctl_der[0], deriv_y = arr_ctl_der[1], deriv_z = arr_ctl_der[2])
+            centerline.compute_vertebral_distribution(coord_physical)
+
+            # save centerline as NIFTI file if subject's SC mask does not exist (needed for straighten_all_subjects() below)
+            if not os.path.isfile(fname_image_seg) and not os.path.isfile(fname_image_centerline):
+                writer.submit(im_centerline.change_orientation(native_orientation).save, fname_image_centerline)
+
+            list_centerline.append(centerline)
+            tqdm_bar.update(1)
     tqdm_bar.close()
     os.chdir(current_path)
     return list_centerline
@@ -460,9 +592,25 @@ def generate_initial_template_space(dataset_info, points_average_centerline, pos
     centerline_template.save_centerline(fname_output = path_template + 'template_label-centerline')
     print(f'\nSaving template centerline as .npz file (saves all Centerline object information, not just coordinates) as {path_template}template_label-centerline.npz\n')
 
+def compute_geometry_fingerprint(list_fname, prefix = ''):
+    """
+    This function computes a fingerprint of the files that define the straightening geometry
+    :param list_fname: list of path + file name of NIFTI files (.nii.gz)
+    :param prefix: string hashed before the files (e.g. straightening parameters, fingerprint of the template files)
+    :return: hexadecimal string, identical as long as the content of the files and the prefix do not change
+    """
+    fingerprint = hashlib.sha1(prefix.encode())
+    for fname in list_fname:
+        # hash the uncompressed content, so that rewriting an identical file (e.g. the template) is not seen as a change
+        with gzip.open(fname, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 ** 2), b''): fingerprint.update(chunk)
+    return fingerprint.hexdigest()
+
 def straighten_all_subjects(dataset_info, normalized = False):
     """
-    This function straighten all images based on template centerline
+    This function straighten all images based on template centerline. The warping field of each subject is kept in
+    the output folder, along with a fingerprint of the subject and template geometry. If the geometry did not change
+    since the previous run, the warping field is applied as-is instead of being recomputed.
     :param dataset_info: dictionary containing dataset information
     :param normalized: True if images were normalized before straightening
     """
@@ -472,6 +620,10 @@ def straighten_all_subjects(dataset_info, normalized = False):
 
     if not os.path.exists(dataset_info['path_data'] + 'derivatives/sct_straighten_spinalcord'): os.makedirs(dataset_info['path_data'] + 'derivatives/sct_straighten_spinalcord')
 
+    # the template is shared by all subjects, so its files are hashed only once
+    param_straightening = 'threshold_distance=1'
+    fingerprint_template = compute_geometry_fingerprint([path_template + 'template_label-centerline.nii.gz', path_template + 'template_labels-disc.nii.gz'], prefix = param_straightening)
+
     # straightening of each subject on the new template
     tqdm_bar = tqdm(total = len(list_subjects), unit = 'B', unit_scale = True, desc = "Status", ascii = True)
     for subject_name in list_subjects:
@@ -484,22 +636,91 @@ def straighten_all_subjects(dataset_info, normalized = False):
         fname_image_centerline =  path_data + 'derivatives/labels/' + subject_name +  '/' + dataset_info['data_type'] + '/' + subject_name + dataset_info['suffix_image'] + '_label-centerline.nii.gz'
         fname_out = subject_name + dataset_info['suffix_image'] + '_straight_norm.nii.gz' if normalized else subject_name + dataset_info['suffix_image'] + '_straight.nii.gz' 
 
+        fname_warp = folder_out + '/' + subject_name + dataset_info['suffix_image'] + '_warp_curve2straight.nii.gz'
+        fname_straight_ref = folder_out + '/' + subject_name + dataset_info['suffix_image'] + '_straight_ref.nii.gz'
+        fname_fingerprint = folder_out + '/' + subject_name + dataset_info['suffix_image'] + '_warp_curve2straight.sha1'
+
         fname_input_seg = fname_image_seg if os.path.isfile(fname_image_seg) else fname_image_centerline
+        fingerprint = compute_geometry_fingerprint([fname_input_seg, fname_image_discs], prefix = fingerprint_template)
+        fingerprint_previous = None
+        if os.path.isfile(fname_warp) and os.path.isfile(fname_straight_ref) and os.path.isfile(fname_fingerprint):
+            with open(fname_fingerprint) as file: fingerprint_previous = file.read().strip()
+
         # go to output folder
         sct.printv('\nStraightening ' + fname_image)
         os.chdir(folder_out)
- 
-        # straighten centerline
-        os.system('sct_straighten_spinalcord' + 
-            ' -i ' + fname_image + 
-            ' -s ' + fname_input_seg + 
-            ' -dest ' + path_template + 'template_label-centerline.nii.gz' + 
-            ' -ldisc-input ' + fname_image_discs +        
-            ' -ldisc-dest ' + path_template + 'template_labels-disc.nii.gz' + 
-            ' -ofolder ' + folder_out + 
-            ' -o ' + fname_out + 
-            ' -disable-straight2curved' + 
-            ' -param threshold_distance=1')
+
+        status = None
+        if fingerprint == fingerprint_previous:
+            # same geometry as the previous run: only resample the image with the saved warping field
+            status = os.system('sct_apply_transfo' +
+                ' -i ' + fname_image +
+                ' -d ' + fname_straight_ref +
+                ' -w ' + fname_warp +
+                ' -o ' + folder_out + '/' + fname_out +
+                ' -x spline')
+            if status != 0: sct.printv('ERROR: resampling ' + fname_image + ' with the saved warping field failed. Straightening it again.')
+        if status != 0:
+            # straighten centerline
+            status = os.system('sct_straighten_spinalcord' + 
+                ' -i ' + fname_image + 
+                ' -s ' + fname_input_seg + 
+                ' -dest ' + path_template + 'template_label-centerline.nii.gz' + 
+                ' -ldisc-input ' + fname_image_discs +        
+                ' -ldisc-dest ' + path_template + 'template_labels-disc.nii.gz' + 
+                ' -ofolder ' + folder_out + 
+                ' -o ' + fname_out + 
+                ' -disable-straight2curved' + 
+                ' -param ' + param_straightening)
+
+            # keep the warping field of this subject for the next runs
+            if status == 0:
+                shutil.move(folder_out + '/warp_curve2straight.nii.gz', fname_warp)
+                shutil.move(folder_out + '/straight_ref.nii.gz', fname_straight_ref)
+                with open(fname_fingerprint, 'w') as file: file.write(fingerprint + '\n')
+            else:
+                # remove the warping field and output of the previous geometry, so that they can never be used again
+                sct.printv('ERROR: straightening ' + fname_image + ' failed.')
+                for fname in [fname_fingerprint, fname_warp, fname_straight_ref, folder_out + '/' + fname_out]:
+                    if os.path.isfile(fname): os.remove(fname)
+        tqdm_bar.update(1)
+    tqdm_bar.close()
+
+def apply_straightening_all_subjects(dataset_info, suffix_image_ref):
+    """
+    This function straightens all images of a contrast by reusing the warping fields computed by
+    straighten_all_subjects() on the reference contrast, so that all contrasts are perfectly aligned
+    :param dataset_info: dictionary containing dataset information of the contrast to straighten
+    :param suffix_image_ref: suffix of the reference contrast, already straightened
+    """
+    path_data = dataset_info['path_data']
+    list_subjects = dataset_info['include_list'].split(' ')
+
+    tqdm_bar = tqdm(total = len(list_subjects), unit = 'B', unit_scale = True, desc = "Status", ascii = True)
+    for subject_name in list_subjects:
+        folder_out = path_data + 'derivatives/sct_straighten_spinalcord/' + subject_name + '/' + dataset_info['data_type'] + '/'
+        fname_image = path_data + subject_name + '/' + dataset_info['data_type'] + '/' + subject_name + dataset_info['suffix_image'] + '.nii.gz'
+        fname_out = folder_out + subject_name + dataset_info['suffix_image'] + '_straight.nii.gz'
+        fname_warp = folder_out + subject_name + suffix_image_ref + '_warp_curve2straight.nii.gz'
+        fname_straight_ref = folder_out + subject_name + suffix_image_ref + '_straight_ref.nii.gz'
+
+        # images of the same subject are expected to be aligned in the physical space, so the warping field applies as-is
+        sct.printv('\nStraightening ' + fname_image)
+        status = None
+        if os.path.isfile(fname_warp) and os.path.isfile(fname_straight_ref):
+            status = os.system('sct_apply_transfo' +
+                ' -i ' + fname_image +
+                ' -d ' + fname_straight_ref +
+                ' -w ' + fname_warp +
+                ' -o ' + fname_out +
+                ' -x spline')
+        else:
+            sct.printv('ERROR: warping field of the reference contrast not found for ' + subject_name + ' (' + fname_warp + ').')
+
+        # remove any output of a previous run, so that a misaligned image is never used by the next steps
+        if status != 0:
+            if status is not None: sct.printv('ERROR: straightening ' + fname_image + ' failed.')
+            if os.path.isfile(fname_out): os.remove(fname_out)
         tqdm_bar.update(1)
     tqdm_bar.close()
 
@@ -517,11 +738,19 @@ def normalize_intensity_template(dataset_info, verbose = 1):
 
     tqdm_bar = tqdm(total = len(list_subjects), unit = 'B', unit_scale = True, desc = "Status", ascii = True)
 
+    def get_fname(subject_name):
+        return dataset_info['path_data'] + 'derivatives/sct_straighten_spinalcord/' + subject_name + '/' + dataset_info['data_type'] + '/' + subject_name + dataset_info['suffix_image'] + '_straight.nii.gz'
+
+    # loading straightened image of one subject (run in the background by prefetch())
+    def load_subject(subject_name):
+        return Image(get_fname(subject_name))
+
+    def get_size_subject(subject_name):
+        return get_size_nifti([get_fname(subject_name)])
+
     # computing the intensity profile for each subject
-    for subject_name in list_subjects:
-        fname_image = dataset_info['path_data'] + 'derivatives/sct_straighten_spinalcord/' + subject_name + '/' + dataset_info['data_type'] + '/' + subject_name + dataset_info['suffix_image'] + '_straight.nii.gz'
-        centerline_template = Centerline(fname = fname_template_centerline)
-        image = Image(fname_image)
+    centerline_template = Centerline(fname = fname_template_centerline)
+    for subject_name, image in prefetch(list_subjects, load_subject, get_size_subject):
         nx, ny, nz, nt, px, py, pz, pt = image.dim
         x, y, z, xd, yd, zd = average_coordinates_over_slices(self = centerline_template, image = image)
 
@@ -600,20 +829,19 @@ def normalize_intensity_template(dataset_info, verbose = 1):
     average_intensity = 1000.0
 
     # normalize the intensity of the image based on spinal cord
-    for subject_name in list_subjects:
-        fname_image = dataset_info['path_data'] + 'derivatives/sct_straighten_spinalcord/' + subject_name + '/' + dataset_info['data_type'] + '/' + subject_name + dataset_info['suffix_image'] + '_straight.nii.gz'
-        fname_image_normalized = dataset_info['path_data'] + 'derivatives/sct_straighten_spinalcord/' + subject_name + '/' + dataset_info['data_type'] + '/' + subject_name + dataset_info['suffix_image'] + '_straight_norm.nii.gz'
-        image = Image(fname_image)
-        nx, ny, nz, nt, px, py, pz, pt = image.dim
+    with BackgroundWriter() as writer:
+        for subject_name, image in prefetch(list_subjects, load_subject, get_size_subject):
+            fname_image_normalized = dataset_info['path_data'] + 'derivatives/sct_straighten_spinalcord/' + subject_name + '/' + dataset_info['data_type'] + '/' + subject_name + dataset_info['suffix_image'] + '_straight_norm.nii.gz'
+            nx, ny, nz, nt, px, py, pz, pt = image.dim
 
-        image_new = image.copy()
-        image_new.change_type(dtype = 'float32')
-        for i in range(nz):
-            if intensity_profiles[subject_name][i] == 0: intensity_profiles[subject_name][i] = 0.001
-            image_new.data[:, :, i] *= average_intensity / intensity_profiles[subject_name][i]
+            image_new = image.copy()
+            image_new.change_type(dtype = 'float32')
+            for i in range(nz):
+                if intensity_profiles[subject_name][i] == 0: intensity_profiles[subject_name][i] = 0.001
+                image_new.data[:, :, i] *= average_intensity / intensity_profiles[subject_name][i]
 
-        # Save intensity normalized template
-        image_new.save(fname_image_normalized)
+            # Save intensity normalized template
+            writer.submit(image_new.save, fname_image_normalized)
 
 def copy_preprocessed_images(dataset_info):
     list_subjects = dataset_info['include_list'].split(' ') 
@@ -641,13 +869,13 @@ def create_mask_template(dataset_info):
     os.system('nii2mnc ' + path_template + '/template_mask.nii.gz ' + ' ' + path_template + '/template_mask.mnc')
     return path_template + 'template_mask.mnc'
 
-def convert_data2mnc(dataset_info):
+def convert_data2mnc(dataset_info, fname_subjects = 'subjects.csv'):
     path_template = dataset_info['path_data'] + 'derivatives/template/'
     list_subjects = dataset_info['include_list'].split(' ')
 
     path_template_mask = create_mask_template(dataset_info)
 
-    output_list = open(path_template + 'subjects.csv', "w")
+    output_list = open(path_template + fname_subjects, "w")
     writer = csv.writer(output_list, delimiter = ',', quotechar = ',', quoting = csv.QUOTE_MINIMAL)
 
     tqdm_bar = tqdm(total = len(list_subjects), unit = 'B', unit_scale = True, desc = "Status", ascii = True)
@@ -672,35 +900,44 @@ def convert_data2mnc(dataset_info):
 # =======================================================================================================================
 def main(configuration_file):
     """
-    Pipeline for data processing.
+    Pipeline for data processing. If several contrasts are listed in the configuration file, the template space is
+    computed once from the reference contrast (the first one) and shared by all contrasts.
     """
     dataset_info = read_dataset(configuration_file)
+    list_dataset_info = split_contrasts(dataset_info)
+    dataset_info_ref = list_dataset_info[0]
     Centerline.list_labels = [50, 49] + list(range(int(dataset_info['last_disc']) + 1))
     # generating centerlines
-    list_centerline = generate_centerline(dataset_info = dataset_info)
+    list_centerline = generate_centerline(dataset_info = dataset_info_ref)
 
     # computing average template centerline and vertebral distribution
     points_average_centerline, position_template_discs = average_centerline(list_centerline = list_centerline,
-        dataset_info = dataset_info,
+        dataset_info = dataset_info_ref,
         use_ICBM152 = False,
         use_label_ref = 'C1')
 
     # generating the initial template space
-    generate_initial_template_space(dataset_info = dataset_info,
+    generate_initial_template_space(dataset_info = dataset_info_ref,
         points_average_centerline = points_average_centerline,
         position_template_discs = position_template_discs)
 
     # straightening of all spinal cord
-    straighten_all_subjects(dataset_info = dataset_info)
+    straighten_all_subjects(dataset_info = dataset_info_ref)
+
+    for dataset_info_contrast in list_dataset_info:
+        # straightening of the other contrasts, using the warping fields of the reference contrast
+        if dataset_info_contrast is not dataset_info_ref:
+            apply_straightening_all_subjects(dataset_info = dataset_info_contrast, suffix_image_ref = dataset_info_ref['suffix_image'])
 
-    # normalize image intensity inside the spinal cord
-    normalize_intensity_template(dataset_info = dataset_info)
+        # normalize image intensity inside the spinal cord
+        normalize_intensity_template(dataset_info = dataset_info_contrast)
 
-    # copy preprocessed dataset in template folder
-    copy_preprocessed_images(dataset_info = dataset_info)
+        # copy preprocessed dataset in template folder
+        copy_preprocessed_images(dataset_info = dataset_info_contrast)
 
-    # converting results to Minc format
-    convert_data2mnc(dataset_info)
+        # converting results to Minc format
+        fname_subjects = 'subjects.csv' if len(list_dataset_info) == 1 else 'subjects' + dataset_info_contrast['suffix_image'] + '.csv'
+        convert_data2mnc(dataset_info_contrast, fname_subjects = fname_subjects)
 
 # =======================================================================================================================
 # Start program
@@ -0,0 +1,201 @@
+'''
+Segment the spinal cord and label the intervertebral discs of all subjects listed in the configuration file,
+in preparation for quality control (QC) and manual correction. This is the Python equivalent of running
+`preprocess_segment.sh` through `sct_run_batch`, with the following differences:
+
+* Subjects are processed in parallel, in a pool of `-jobs` workers.
+* A step is skipped when its output already exists and is newer than its inputs, so rerunning the script after
+    QC only processes what changed.
+* Labels found in `path_data/derivatives/labels` (i.e. manually corrected files) are used as-is and are never
+    overwritten.
+* The duration of each step is recorded in `PATH_OUT/results/timings.csv`.
+
+The outputs are written in `PATH_OUT` according to the following file structure:
+
+├── data_processed
+│   ├── sub-XXX
+│   │   └── anat
+│   │       └──sub-XXX_T1w.nii.gz
+│   ...
+│   └── derivatives
+│       └── labels
+│           ├── sub-XXX
+│           │   └── anat
+│           │       │──sub-XXX_T1w_label-SC_mask.nii.gz  <---- spinal cord segmentation
+│           │       └──sub-XXX_T1w_labels-disc.nii.gz  <---- disc labels
+│           ...
+├── log
+├── qc
+└── results
+
+Usage: `python preprocess_segment.py configuration.json PATH_OUT -jobs N_CPU`
+'''
+
+import argparse
+import csv
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
+
+from preprocess_normalize import read_dataset, split_contrasts
+
+def is_up_to_date(fname_output, list_fname_input):
+    """
+    This function checks if an output file exists and is newer than all of its inputs
+    :param fname_output: path + file name of the output file
+    :param list_fname_input: list of path + file name of the files the output was computed from
+    :return: True if the output file does not need to be recomputed
+    """
+    if not os.path.isfile(fname_output): return False
+    mtime_output = os.path.getmtime(fname_output)
+    return all(os.path.getmtime(fname_input) <= mtime_output for fname_input in list_fname_input)
+
+def segment_subject(dataset_info, subject_name, path_out):
+    """
+    This function segments the spinal cord and labels the intervertebral discs of one subject, skipping the steps
+    that are already up to date or that were manually corrected in `path_data/derivatives/labels`
+    :param dataset_info: dictionary containing dataset information
+    :param subject_name: subject ID (e.g. sub-001)
+    :param path_out: output folder (data_processed, qc, log and results will be created inside)
+    :return: list of [subject, step, status, duration in seconds] for each step run (status is one of 'done',
+             'skipped', 'manual' or 'failed'), and the error message if a step failed (None otherwise)
+    """
+    path_data = dataset_info['path_data']
+    path_processed = path_out + 'data_processed/'
+    path_qc = path_out + 'qc/'
+    prefix = subject_name + dataset_info['suffix_image']
+
+    fname_image = path_data + subject_name + '/' + dataset_info['data_type'] + '/' + prefix + '.nii.gz'
+    folder_image = path_processed + subject_name + '/' + dataset_info['data_type'] + '/'
+    folder_labels = path_processed + 'derivatives/labels/' + subject_name + '/' + dataset_info['data_type'] + '/'
+    folder_labels_manual = path_data + 'derivatives/labels/' + subject_name + '/' + dataset_info['data_type'] + '/'
+    fname_image_local = folder_image + prefix + '.nii.gz'
+    fname_seg = folder_labels + prefix + '_label-SC_mask.nii.gz'
+    fname_discs = folder_labels + prefix + '_labels-disc.nii.gz'
+    fname_seg_manual = folder_labels_manual + prefix + '_label-SC_mask.nii.gz'
+    fname_discs_manual = folder_labels_manual + prefix + '_labels-disc.nii.gz'
+
+    if not os.path.exists(folder_image): os.makedirs(folder_image)
+    if not os.path.exists(folder_labels): os.makedirs(folder_labels)
+
+    timings = []
+    log_file = open(path_out + 'log/' + subject_name + '.log', 'a')
+    def run_step(step, fname_output, list_fname_input, fname_manual, list_cmd):
+        start = time.time()
+        if fname_manual is not None and os.path.isfile(fname_manual):
+            status = 'manual'
+        elif is_up_to_date(fname_output, list_fname_input):
+            status = 'skipped'
+        else:
+            try:
+                for cmd in list_cmd:
+                    if callable(cmd):
+                        cmd()
+                    else:
+                        log_file.write(' '.join(cmd) + '\n')
+                        log_file.flush()
+                        subprocess.run(cmd, check = True, stdout = log_file, stderr = subprocess.STDOUT)
+            except Exception:
+                timings.append([subject_name, step, 'failed', round(time.time() - start, 2)])
+                raise
+            status = 'done'
+        timings.append([subject_name, step, status, round(time.time() - start, 2)])
+
+    error = None
+    try:
+        # copy source image (copy2 keeps the modification time, so that the copy is not seen as a new input)
+        run_step('copy', fname_image_local, [fname_image], None, [lambda: shutil.copy2(fname_image, fname_image_local)])
+
+        # segment spinal cord (SC), unless a manually corrected segmentation exists
+        run_step('sct_deepseg_sc', fname_seg, [fname_image_local], fname_seg_manual,
+            [['sct_deepseg_sc', '-i', fname_image_local, '-o', fname_seg, '-c', dataset_info['contrast'], '-qc', path_qc, '-qc-subject', subject_name]])
+
+        # label discs, unless manually corrected disc labels exist; labeling is based on the corrected segmentation if any
+        fname_seg_input = fname_seg_manual if os.path.isfile(fname_seg_manual) else fname_seg
+        fname_seg_labeled = folder_labels + os.path.basename(fname_seg_input).replace('.nii.gz', '_labeled.nii.gz')
+        fname_seg_labeled_discs = folder_labels + os.path.basename(fname_seg_input).replace('.nii.gz', '_labeled_discs.nii.gz')
+        run_step('sct_label_vertebrae', fname_discs, [fname_image_local, fname_seg_input], fname_discs_manual,
+            [['sct_label_vertebrae', '-i', fname_image_local, '-s', fname_seg_input, '-c', dataset_info['contrast'], '-ofolder', folder_labels, '-qc', path_qc, '-qc-subject', subject_name],
+             lambda: os.replace(fname_seg_labeled_discs, fname_discs),
+             lambda: os.remove(fname_seg_labeled)])
+    except Exception as e:
+        # the following steps depend on the failed one, so they are not run
+        error = str(e)
+    finally:
+        log_file.close()
+    return timings, error
+
+def segment_all_subjects(dataset_info, path_out, jobs = 1):
+    """
+    This function runs segment_subject() for all subjects, in a pool of `jobs` parallel workers
+    :param dataset_info: dictionary containing dataset information
+    :param path_out: output folder (data_processed, qc, log and results will be created inside)
+    :param jobs: maximum number of subjects processed at the same time
+    :return: list of [subject, step, status, duration in seconds] for all subjects and steps (the message of a
+             failed step is written in log/error.log)
+    """
+    list_subjects = dataset_info['include_list'].split(' ')
+    path_log = path_out + 'log/'
+    if not os.path.exists(path_log): os.makedirs(path_log)
+
+    timings = []
+    tqdm_bar = tqdm(total = len(list_subjects), unit = 'B', unit_scale = True, desc = "Status", ascii = True)
+    with ThreadPoolExecutor(max_workers = jobs) as executor:
+        futures = {executor.submit(segment_subject, dataset_info, subject_name, path_out): subject_name for subject_name in list_subjects}
+        for future in as_completed(futures):
+            try:
+                timings_subject, error = future.result()
+                timings += timings_subject
+            except Exception as e:
+                # error outside of the steps (e.g. output folder cannot be created)
+                error = str(e)
+                timings.append([futures[future], 'error', 'failed', None])
+            if error is not None:
+                # log the error and carry on with the other subjects, as sct_run_batch does
+                with open(path_log + 'error.log', 'a') as error_log: error_log.write(futures[future] + ': ' + error + '\n')
+            tqdm_bar.update(1)
+    tqdm_bar.close()
+    return timings
+
+def save_timings(timings, fname_out):
+    """
+    This function saves the duration of each step as a CSV file
+    :param timings: list of [subject, step, status, duration in seconds]
+    :param fname_out: path + file name of the output CSV file
+    """
+    with open(fname_out, 'w', newline = '') as output_file:
+        writer = csv.writer(output_file, delimiter = ',')
+        writer.writerow(['subject', 'step', 'status', 'duration'])
+        writer.writerows(sorted(timings, key = lambda x: x[0]))
+
+# main
+# =======================================================================================================================
+def main(configuration_file, path_out, jobs = 1):
+    """
+    Pipeline for segmentation and disc labeling.
+    """
+    # only the reference contrast is segmented, as it defines the geometry shared by all contrasts
+    dataset_info = split_contrasts(read_dataset(configuration_file))[0]
+    path_out = os.path.abspath(path_out) + '/'
+    if path_out.startswith(os.path.abspath(dataset_info['path_data']) + '/'):
+        raise ValueError('Output folder must not be inside path_data, to avoid overwriting manually corrected labels.')
+
+    timings = segment_all_subjects(dataset_info = dataset_info, path_out = path_out, jobs = jobs)
+
+    if not os.path.exists(path_out + 'results/'): os.makedirs(path_out + 'results/')
+    save_timings(timings, path_out + 'results/timings.csv')
+    print(f'\nSaving duration of each step as {path_out}results/timings.csv\n')
+
+# =======================================================================================================================
+# Start program
+# =======================================================================================================================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = 'Segment the spinal cord and label the intervertebral discs of all subjects.')
+    parser.add_argument('configuration_file', help = 'Configuration file (e.g. configuration.json).')
+    parser.add_argument('path_out', help = 'Output folder for processed data, QC, logs and results. Must not be inside path_data.')
+    parser.add_argument('-jobs', type = int, default = 1, help = 'Number of subjects processed in parallel.')
+    args = parser.parse_args()
+    main(args.configuration_file, args.path_out, args.jobs)